@@ -8,7 +8,7 @@
 QGIS Processing Algorithm for Local Maxima Detection in Raster Data (skimage)
 
 Requirements:
-- Python packages: numpy, rasterio, scikit-image
+- Python packages: numpy, rasterio, scipy
 - QGIS version: 3.40 or newer
 """
 
@@ -22,9 +22,21 @@ from qgis.core import (
 )
 from qgis.PyQt.QtCore import QCoreApplication
 import numpy as np
-import importlib.util
-import subprocess
-import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Third-party packages are imported once per session; checkDependencies
+# reports the ones that are missing
+try:
+    import rasterio
+    from rasterio.transform import from_origin
+except ImportError:
+    rasterio = None
+
+try:
+    from scipy.ndimage import maximum_filter1d
+except ImportError:
+    maximum_filter1d = None
 
 class LocalMaximaDetection(QgsProcessingAlgorithm):
     """
@@ -46,6 +58,9 @@ class LocalMaximaDetection(QgsProcessingAlgorithm):
     NEIGHBORHOOD_SIZE = 'NEIGHBORHOOD_SIZE'
     OUTPUT_LAYER = 'OUTPUT_LAYER'
 
+    # Rows or columns per block when the maximum filter is split across threads
+    BLOCK_SIZE = 512
+
     def tr(self, text):
         """Provides translation support for UI strings"""
         return QCoreApplication.translate('LocalMaximaDetection', text)
@@ -56,39 +71,45 @@ class LocalMaximaDetection(QgsProcessingAlgorithm):
 
     def checkDependencies(self, feedback):
         """
-        Verifies and installs required Python packages.
+        Verifies that the required Python packages are installed.
         
         Raises:
-            QgsProcessingException: If installation fails
+            QgsProcessingException: If any package is missing
+        """
+        required = {'rasterio': rasterio, 'scipy': maximum_filter1d}
+        missing = [package for package, module in required.items() if module is None]
+
+        if missing:
+            raise QgsProcessingException(
+                self.tr(f"Missing required Python packages: {', '.join(missing)}. "
+                        f"Install them into the QGIS Python environment (e.g. pip install {' '.join(missing)}) "
+                        f"and run the algorithm again.")
+            )
+
+    def neighborhoodMaximum(self, raster_data, footprint_size, output):
         """
-        required = {'rasterio': 'rasterio', 'skimage': 'scikit-image'}
-        to_install = []
-
-        # Check for missing packages
-        for module, package in required.items():
-            if not importlib.util.find_spec(module):
-                to_install.append(package)
-
-        # Install missing packages
-        if to_install:
-            feedback.pushInfo(self.tr(f"Installing required packages: {', '.join(to_install)}"))
-            try:
-                subprocess.check_call(
-                    [sys.executable, '-m', 'pip', 'install', *to_install],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.STDOUT
-                )
-            except subprocess.CalledProcessError as e:
-                raise QgsProcessingException(
-                    self.tr("Package installation failed. Error code: ") + str(e.returncode)
-                )
-
-            # Verify installation
-            for module in required.keys():
-                if not importlib.util.find_spec(module):
-                    raise QgsProcessingException(
-                        self.tr(f"Critical error: {module} could not be installed automatically")
-                    )
+        Writes the maximum over a footprint_size x footprint_size window of every cell into output.
+
+        The separable window is computed as a row pass into output followed by
+        an in-place column pass (O(1)-per-pixel 1-D running maximum), so no
+        temporary raster is allocated. Each pass is split into independent
+        blocks of rows or columns filtered in parallel threads (SciPy
+        releases the GIL).
+        """
+        rows, cols = raster_data.shape
+
+        def filter_rows(start):
+            block = slice(start, start + self.BLOCK_SIZE)
+            maximum_filter1d(raster_data[block], size=footprint_size, axis=1, output=output[block], mode='nearest')
+
+        def filter_columns(start):
+            block = output[:, start:start + self.BLOCK_SIZE]
+            maximum_filter1d(block, size=footprint_size, axis=0, output=block, mode='nearest')
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(filter_rows, range(0, rows, self.BLOCK_SIZE)))
+            list(executor.map(filter_columns, range(0, cols, self.BLOCK_SIZE)))
+        return output
 
     def initAlgorithm(self, config=None):
         """Defines algorithm parameters and UI configuration"""
@@ -121,41 +142,75 @@ class LocalMaximaDetection(QgsProcessingAlgorithm):
         Executes the core processing logic.
         """
         try:
-            # Check and install dependencies
+            # Check dependencies
             self.checkDependencies(feedback)
-            
-            # Import required modules after installation
-            from skimage.feature import peak_local_max
-            import rasterio
-            from rasterio.transform import from_origin
 
             # Extract input parameters from QGIS
             input_layer = self.parameterAsRasterLayer(parameters, self.INPUT_LAYER, context)
             neighborhood_size = self.parameterAsInt(parameters, self.NEIGHBORHOOD_SIZE, context)
             output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT_LAYER, context)
 
-            # Read raster data using QGIS provider
-            provider = input_layer.dataProvider()
-            
-            # Get raster block (single band processing)
-            block = provider.block(1, input_layer.extent(), input_layer.width(), input_layer.height())
-            
-            if not block.isValid():
-                raise QgsProcessingException("Invalid raster data block")
-
-            # Convert QGIS raster block to NumPy array for processing
-            raster_data = block.as_numpy()
-
-            # Detect local maxima using scikit-image
-            coordinates = peak_local_max(
-                raster_data,
-                min_distance=neighborhood_size,
-                exclude_border=False
-            )
+            source = input_layer.source()
+            if source and os.path.exists(source):
+                # Read file-backed rasters straight into an explicitly allocated
+                # buffer, skipping the copy through a QGIS raster block
+                with rasterio.open(source) as src:
+                    raster_data = np.empty((src.height, src.width), dtype=src.dtypes[0])
+                    src.read(1, out=raster_data)
+                    nodata = src.nodata
+            else:
+                # Read raster data using QGIS provider
+                provider = input_layer.dataProvider()
+
+                # Get raster block (single band processing)
+                block = provider.block(1, input_layer.extent(), input_layer.width(), input_layer.height())
+
+                if not block.isValid():
+                    raise QgsProcessingException("Invalid raster data block")
+
+                # Convert QGIS raster block to NumPy array for processing
+                raster_data = block.as_numpy(use_masking=False)
+                nodata = provider.sourceNoDataValue(1) if provider.sourceHasNoDataValue(1) else None
+
+            # Cells holding the band's nodata value never count as peaks and are
+            # left out of the minimum used as the background threshold
+            if nodata is None:
+                valid = None
+            elif np.isnan(nodata):
+                valid = ~np.isnan(raster_data)
+            else:
+                valid = raster_data != nodata
+
+            # Nodata cells are lowered to the smallest value of the data type
+            # before filtering, so they never raise the window maximum of the
+            # valid cells around them
+            if valid is not None and not valid.all():
+                if not raster_data.flags.writeable:
+                    raster_data = raster_data.copy()
+                if np.issubdtype(raster_data.dtype, np.floating):
+                    raster_data[~valid] = -np.inf
+                else:
+                    raster_data[~valid] = np.iinfo(raster_data.dtype).min
+
+            # Maximum value within (2 * neighborhood_size + 1) pixels of every cell
+            footprint_size = 2 * neighborhood_size + 1
+            neighborhood_max = self.neighborhoodMaximum(raster_data, footprint_size, np.empty_like(raster_data))
 
-            # Create binary output raster where maxima are 255
-            local_max = np.zeros_like(raster_data, dtype=np.uint8)
-            local_max[tuple(coordinates.T)] = 255
+            # Create binary output raster where maxima are 255. Cells at the
+            # minimum of the valid cells are ignored, as peak_local_max did, so
+            # flat backgrounds are not reported as peaks. The comparison is
+            # written into a boolean view of the uint8 output, then scaled in place.
+            local_max = np.empty(raster_data.shape, dtype=np.uint8)
+            is_peak = local_max.view(np.bool_)
+            np.equal(raster_data, neighborhood_max, out=is_peak)
+            if valid is None:
+                is_peak &= raster_data > raster_data.min()
+            elif valid.any():
+                is_peak &= raster_data > raster_data[valid].min()
+                is_peak &= valid
+            else:
+                is_peak[...] = False
+            local_max *= 255
 
             # Create georeferencing transform for output
             transform = from_origin(
@@ -192,7 +247,7 @@ class LocalMaximaDetection(QgsProcessingAlgorithm):
 
     def displayName(self):
         """User-friendly algorithm name"""
-        return self.tr('Local Maxima Detection (scikit-image)')
+        return self.tr('Local Maxima Detection (SciPy)')
         
     def shortHelpString(self) -> str:
         """
@@ -205,7 +260,7 @@ class LocalMaximaDetection(QgsProcessingAlgorithm):
         Suitable for finding peaks in elevation models, heatmaps, and other continuous surfaces.
         
         <b>How it works:</b><ul>
-        <li>Applies a maximum filter to find candidate peaks</li>
+        <li>Applies a maximum filter over a (2 × size + 1) pixel window, as separate row and column passes</li>
         <li>Compares original values with filtered results</li>
         <li>Returns positions where original values match maximum filtered values</li>
         </ul>
@@ -228,7 +283,7 @@ class LocalMaximaDetection(QgsProcessingAlgorithm):
         <li>Output coordinate system matches input layer</li>
         </ul>
         
-        Requires scikit-image and rasterio Python packages.
+        Requires scipy and rasterio Python packages.
         """
         return self.tr(self.__doc__)
 
@@ -5,12 +5,84 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterBoolean)
 import os
-import random
+import math
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import rasterio
 from rasterio.windows import Window, transform as window_transform
 import logging
 import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Log to the user directory. The handler is installed once per session rather
+# than every time QGIS creates the algorithm.
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _log_handler = logging.FileHandler(os.path.join(os.path.expanduser("~"), 'process_log.txt'), delay=True)
+    _log_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    logger.addHandler(_log_handler)
+    logger.setLevel(logging.INFO)
+
+
+def _nonzero_words(block, cell):
+    """Reduce a (bands, rows, cols) block to a 2-D non-zero map and the number of map columns per cell.
+
+    Integer blocks are compared as packed uint64 words, 8 bytes at a time, when a
+    cell spans whole words. Float blocks are compared per value so -0.0 stays empty.
+    """
+    itemsize = block.dtype.itemsize
+    if np.issubdtype(block.dtype, np.integer) and (cell * itemsize) % 8 == 0:
+        words = np.ascontiguousarray(block).view(np.uint64)
+        return words.any(axis=0), cell * itemsize // 8
+    return block.any(axis=0), cell
+
+
+def _content_grid(src, indexes, tile_size, stride, ny, nx):
+    """Flag which tiles of the (ny, nx) grid hold a non-zero pixel in the `indexes` bands of `src`."""
+    if ny == 0 or nx == 0:
+        return np.zeros((ny, nx), dtype=bool)
+
+    # Tile origins and sizes are multiples of gcd(tile_size, stride), so the
+    # raster is block-reduced into cells of that size. It is streamed in strips
+    # of whole cells, and each strip is reduced straight away to one flag per
+    # cell row and tile column: a tile column has content in a cell row when
+    # any of its span cells has. Only that (rows / cell, nx) grid is kept,
+    # never a grid of every cell, which would be full resolution when the
+    # gcd is 1.
+    cell = math.gcd(tile_size, stride)
+    span, step = tile_size // cell, stride // cell
+    rows, cols = (ny - 1) * stride + tile_size, (nx - 1) * stride + tile_size
+    cols_any = np.zeros((rows // cell, nx), dtype=bool)
+    strip = cell * max(1, 1024 // cell)
+    for y in range(0, rows, strip):
+        height = min(strip, rows - y)
+        nonzero, width = _nonzero_words(src.read(indexes, window=Window(0, y, cols, height)), cell)
+        cells = nonzero.reshape(height // cell, cell, cols // cell, width).any(axis=(1, 3))
+        cols_any[y // cell:(y + height) // cell] = sliding_window_view(cells, span, axis=1)[:, ::step].any(axis=-1)
+
+    # A tile has content when any of its span cell rows has: the same strided
+    # window reduction, down the columns of the per-row flags
+    return sliding_window_view(cols_any, span, axis=0)[::step].any(axis=-1)
+
+
+def _creation_options(dtype, tile_size, num_threads):
+    """GeoTIFF creation options for a tile: DEFLATE with a predictor, internally tiled when GDAL allows it.
+
+    `num_threads` is the number of GDAL compression threads for each file.
+    """
+    options = {
+        "compress": "deflate",
+        # Floating point predictor for float rasters, horizontal differencing otherwise
+        "predictor": 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2,
+        "num_threads": num_threads,
+        "BIGTIFF": "IF_SAFER",
+    }
+    # GDAL block sizes must be multiples of 16
+    if tile_size % 16 == 0:
+        block_size = min(256, tile_size)
+        options.update({"tiled": True, "blockxsize": block_size, "blockysize": block_size})
+    return options
+
 
 class GenerateImageTiles(QgsProcessingAlgorithm):
     INPUT_IMAGE = 'INPUT_IMAGE'
@@ -38,10 +110,7 @@ class GenerateImageTiles(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterBoolean(self.REMOVE_EMPTY_TILES, 'Remove Empty Tiles', defaultValue=True))
         self.addParameter(QgsProcessingParameterBoolean(self.REMOVE_BACKGROUND_ONLY_TILES, 'Remove Background-Only Tiles', defaultValue=True))
 
-        # Set up logging
-        log_path = os.path.join(os.path.expanduser("~"), 'process_log.txt')  # Path to user directory
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', filename=log_path)
-        logging.info("Algorithm started.")
+        logger.info("Algorithm started.")
 
     def check_dependencies(self):
         """Check if rasterio is installed, and install it if missing."""
@@ -78,71 +147,111 @@ class GenerateImageTiles(QgsProcessingAlgorithm):
         os.makedirs(output_dir, exist_ok=True)
 
         def generate_tiles():
-            """Generate valid image and mask tiles."""
-            with rasterio.open(image_path) as src_img:
-                img_array = src_img.read()
+            """Locate valid tiles, returned as an (N, 2) array of (y, x) pixel offsets in scan order."""
+            with rasterio.open(image_path) as src_img, rasterio.open(mask_path) as src_mask:
                 meta_img = src_img.meta.copy()
-                transform_img = src_img.transform
-                height, width = src_img.height, src_img.width
-            with rasterio.open(mask_path) as src_mask:
-                mask_array = src_mask.read(1)
                 meta_mask = src_mask.meta.copy()
+                height, width = src_img.height, src_img.width
 
-            valid_tiles = []
-            for y in range(0, height - tile_size + 1, stride):
-                for x in range(0, width - tile_size + 1, stride):
-                    tile_img = img_array[:, y:y+tile_size, x:x+tile_size]
-                    tile_mask = mask_array[y:y+tile_size, x:x+tile_size]
-                    new_transform = window_transform(Window(x, y, tile_size, tile_size), transform_img)
+                # Flag the whole tile grid at once
+                ny = len(range(0, height - tile_size + 1, stride))
+                nx = len(range(0, width - tile_size + 1, stride))
 
-                    # Filter out empty tiles and background-only tiles if the respective flags are set
-                    if remove_empty_tiles and np.all(tile_img == 0):  # Skip completely empty tiles
-                        continue
-                    if remove_background_only_tiles and np.all(tile_mask == 0):  # Skip background-only tiles
-                        continue
+                # Filter out empty tiles and background-only tiles if the respective flags are set
+                keep = np.ones((ny, nx), dtype=bool)
+                if remove_empty_tiles:  # Skip completely empty tiles
+                    keep &= _content_grid(src_img, None, tile_size, stride, ny, nx)
+                if remove_background_only_tiles:  # Skip background-only tiles
+                    keep &= _content_grid(src_mask, [1], tile_size, stride, ny, nx)
 
-                    valid_tiles.append({
-                        "x": x, "y": y, "tile_img": tile_img, "tile_mask": tile_mask, "transform": new_transform
-                    })
-            return valid_tiles, meta_img, meta_mask
+            # Only tile offsets are kept; pixels are read from disk when the tile is saved
+            coords = (np.argwhere(keep) * stride).astype(np.int32)
+            return coords, meta_img, meta_mask
 
         # Generate valid tiles
-        tiles, meta_img, meta_mask = generate_tiles()
-        feedback.pushInfo(f"Total valid tiles extracted: {len(tiles)}")
+        coords, meta_img, meta_mask = generate_tiles()
+        feedback.pushInfo(f"Total valid tiles extracted: {len(coords)}")
 
-        random.shuffle(tiles)
-        n_total = len(tiles)
+        # Shuffle tile indices rather than the tiles themselves. Each split is
+        # then sorted back into scan order so its tiles are visited sequentially.
+        n_total = len(coords)
         n_train = int(n_total * train_split)
         n_val = int(n_total * val_split)
-        train_tiles, val_tiles, test_tiles = tiles[:n_train], tiles[n_train:n_train+n_val], tiles[n_train+n_val:]
-        feedback.pushInfo(f"Train: {len(train_tiles)} | Validation: {len(val_tiles)} | Test: {len(test_tiles)}")
+        permutation = np.random.default_rng().permutation(n_total)
+        train_idx, val_idx, test_idx = (np.sort(idx) for idx in np.split(permutation, [n_train, n_train + n_val]))
+        feedback.pushInfo(f"Train: {len(train_idx)} | Validation: {len(val_idx)} | Test: {len(test_idx)}")
+
+        # Tiles are written by a pool of one thread per core. Each file is then
+        # compressed on a single thread, so files are compressed in parallel
+        # rather than every writer also asking GDAL for all cores; with a
+        # single worker, GDAL may use all of them.
+        workers = os.cpu_count() or 1
+        gdal_threads = "ALL_CPUS" if workers == 1 else "1"
+
+        def tile_profile(meta):
+            """Build the profile shared by every tile of a raster; only the transform varies per tile."""
+            profile = {key: value for key, value in meta.items() if key != "transform"}
+            profile.update({"driver": "GTiff", "height": tile_size, "width": tile_size})
+            profile.update(_creation_options(meta["dtype"], tile_size, gdal_threads))
+            return profile
+
+        img_profile = tile_profile(meta_img)
+        mask_profile = tile_profile(meta_mask)
 
-        def save_tile(tile_data, meta_img, meta_mask, split, tile_name):
+        def save_tile(tile_data, img_profile, mask_profile, split, tile_name):
             """Save individual tiles to the output folder."""
             img_out_path = os.path.join(output_dir, split, "images")
             mask_out_path = os.path.join(output_dir, split, "masks")
             os.makedirs(img_out_path, exist_ok=True)
             os.makedirs(mask_out_path, exist_ok=True)
 
-            meta_tile_img = meta_img.copy()
-            meta_tile_img.update({"driver": "GTiff", "height": tile_size, "width": tile_size, "transform": tile_data["transform"]})
-            meta_tile_mask = meta_mask.copy()
-            meta_tile_mask.update({"driver": "GTiff", "height": tile_size, "width": tile_size, "transform": tile_data["transform"]})
-
-            with rasterio.open(os.path.join(img_out_path, f"{tile_name}.tif"), "w", **meta_tile_img) as dst_img:
+            with rasterio.open(os.path.join(img_out_path, f"{tile_name}.tif"), "w",
+                               transform=tile_data["transform"], **img_profile) as dst_img:
                 dst_img.write(tile_data["tile_img"])
-            with rasterio.open(os.path.join(mask_out_path, f"{tile_name}.tif"), "w", **meta_tile_mask) as dst_mask:
+            with rasterio.open(os.path.join(mask_out_path, f"{tile_name}.tif"), "w",
+                               transform=tile_data["transform"], **mask_profile) as dst_mask:
                 dst_mask.write(tile_data["tile_mask"], 1)
 
-        # Save tiles to respective folders based on splits
+        # GDAL settings for the save loop: a 1 GB block cache, no free-space
+        # check on every created file and the per-file compression threads
+        gdal_options = {"GDAL_CACHEMAX": "1024", "CHECK_DISK_FREE_SPACE": "NO", "GDAL_NUM_THREADS": gdal_threads}
+
+        def save_job(tile_data, split, tile_name):
+            """Save one tile with the save loop's GDAL settings."""
+            # rasterio.Env is thread-local, so it is entered in the worker thread
+            with rasterio.Env(**gdal_options):
+                save_tile(tile_data, img_profile, mask_profile, split, tile_name)
+
+        # Save tiles to respective folders based on splits. Tiles are read in
+        # the main thread, in scan order within each split, and written from a
+        # thread pool since rasterio releases the GIL inside GDAL. At most
+        # max_pending tiles wait in memory for their writer.
+        max_pending = 2 * workers
         tile_counter = 0
-        for split, split_tiles in zip(["train", "val", "test"], [train_tiles, val_tiles, test_tiles]):
-            for tile_data in split_tiles:
-                save_tile(tile_data, meta_img, meta_mask, split, f"tile_{tile_counter}")
-                tile_counter += 1
+        with rasterio.Env(**gdal_options), rasterio.open(image_path) as src_img, \
+                rasterio.open(mask_path) as src_mask, ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for split, split_idx in zip(["train", "val", "test"], [train_idx, val_idx, test_idx]):
+                for y, x in coords[split_idx]:
+                    window = Window(int(x), int(y), tile_size, tile_size)
+                    tile_data = {
+                        "tile_img": src_img.read(window=window),
+                        "tile_mask": src_mask.read(1, window=window),
+                        "transform": window_transform(window, meta_img["transform"]),
+                    }
+
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(executor.submit(save_job, tile_data, split, f"tile_{tile_counter}"))
+                    tile_counter += 1
+
+            for future in pending:
+                future.result()
 
         feedback.pushInfo("Tiles saved successfully.")
-        logging.info("Process completed successfully.")
+        logger.info("Process completed successfully.")
         return {self.OUTPUT_FOLDER: output_dir}
 
 
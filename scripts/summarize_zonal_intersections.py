@@ -6,6 +6,11 @@
 # --------------------------------------------------
 
 from qgis.PyQt.QtCore import QVariant
+import numpy as np
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from qgis.core import (
     QgsProcessingAlgorithm,
     QgsProcessingParameterFeatureSource,
@@ -17,11 +22,16 @@ from qgis.core import (
     QgsField,
     QgsFields,
     QgsFeatureSink,
+    QgsFeatureRequest,
     QgsProcessingException,
     QgsProcessing,
-    QgsProcessingUtils
+    QgsProcessingUtils,
+    QgsSpatialIndex
 )
 
+# Tipos de geometria resolvidos uma única vez, na importação do módulo
+POLY, LINE, POINT = QgsWkbTypes.PolygonGeometry, QgsWkbTypes.LineGeometry, QgsWkbTypes.PointGeometry
+
 class SummarizeIntersection(QgsProcessingAlgorithm):
     INPUT_ZONES = 'INPUT_ZONES'
     ZONE_FIELDS = 'ZONE_FIELDS'
@@ -29,6 +39,9 @@ class SummarizeIntersection(QgsProcessingAlgorithm):
     CLASS_FIELDS = 'CLASS_FIELDS'
     SUM_FIELDS = 'SUM_FIELDS'
     OUTPUT = 'OUTPUT'
+    
+    # Número de feições de saída enviadas ao sink de cada vez
+    BATCH_SIZE = 1000
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -111,16 +124,20 @@ class SummarizeIntersection(QgsProcessingAlgorithm):
                 output_fields.append(f)
         
         # Adicionar campos condicionalmente
-        if zone_type == QgsWkbTypes.PolygonGeometry and class_type == QgsWkbTypes.PolygonGeometry:
+        if zone_type == POLY and class_type == POLY:
             output_fields.append(QgsField('AREA', QVariant.Double))
         
-        if class_type == QgsWkbTypes.LineGeometry:
+        if class_type == LINE:
             output_fields.append(QgsField('LENGTH', QVariant.Double))
         
-        if class_type == QgsWkbTypes.PointGeometry:
+        if class_type == POINT:
             output_fields.append(QgsField('PNT_COUNT', QVariant.Int))
         
         output_fields.append(QgsField('PERCENTAGE', QVariant.Double))
+        
+        # Soma proporcional de cada campo de soma das classes
+        for field in sum_fields:
+            output_fields.append(QgsField(f'SUM_{field}', QVariant.Double))
 
         (sink, dest_id) = self.parameterAsSink(
             parameters,
@@ -131,76 +148,151 @@ class SummarizeIntersection(QgsProcessingAlgorithm):
             zones_source.sourceCrs()
         )
         
-        zones = self.groupFeatures(zones_source, zone_fields)
-        classes = self.groupFeatures(classes_source, class_fields) if class_fields else {'ALL': list(classes_source.getFeatures())}
+        # Índices dos campos resolvidos uma única vez, fora dos laços
+        sum_field_idx = [classes_source.fields().lookupField(field) for field in sum_fields]
         
-        total = len(zones) * len(classes) if zones and classes else 1
-        current = 0
-
-        for zone_key, zone_features in zones.items():
-            for zone_feature in zone_features:
-                zone_geom = zone_feature.geometry()
-                total_zone_measure = self.calculateTotalMeasure(zone_geom, zones_source.wkbType())
+        zones = self.readZones(zones_source, zone_fields)
+        (class_groups, class_geoms, class_index,
+         row_groups, class_totals, class_values) = self.indexClassFeatures(classes_source, class_type, class_fields, sum_field_idx, feedback)
+        
+        # Medida da interseção e porcentagem resolvidas uma única vez para o
+        # par de tipos de geometria; a coluna de medida (AREA, LENGTH ou
+        # PNT_COUNT) é a que corresponde ao tipo da classe
+        measure_fn, percent_fn = self.measureStrategy(zone_type, class_type)
+        measure_value = int if class_type == POINT else float
+        
+        # Classes de pontos só são contadas: basta o teste de interseção
+        count_only = class_type == POINT
+        
+        def process_zone(zone_geom, zone_attrs):
+            """Mede e reduz os pares de uma zona, devolvendo as feições de saída"""
+            # Zonas ainda na fila quando o usuário cancela não fazem nenhum trabalho
+            if feedback.isCanceled():
+                return []
+            
+            candidate_rows = class_index.intersects(zone_geom.boundingBox())
+            
+            # Sem candidatas no índice não há interseção possível: a zona não
+            # gera linhas e não precisa de medida, atributos nem motor de geometria
+            if not candidate_rows:
+                return []
+            
+            total_zone_measure = self.calculateTotalMeasure(zone_geom, zone_type)
+            
+            # Geometria da zona preparada uma única vez (índice de arestas no
+            # GEOS) para todos os testes contra as classes candidatas
+            zone_engine = QgsGeometry.createGeometryEngine(zone_geom.constGet())
+            zone_engine.prepareGeometry()
+            
+            # Junção filtro/refinamento: cada par (zona, classe candidata) é
+            # medido uma única vez; a redução por grupo de classe é feita
+            # depois, de forma vetorial, só sobre os pares encontrados
+            pair_rows = []
+            pair_measures = []
+            for class_row in sorted(candidate_rows):
+                class_geom = class_geoms[class_row]
+                class_part = class_geom.constGet()
+                if not zone_engine.intersects(class_part):
+                    continue
                 
-                for class_key, class_features in classes.items():
-                    class_measures = {
-                        'AREA': 0.0,
-                        'LENGTH': 0.0,
-                        'PNT_COUNT': 0,
-                        'SUM_FIELDS': {field: 0.0 for field in sum_fields}
-                    }
-                    
-                    for class_feature in class_features:
-                        class_geom = class_feature.geometry()
-                        if zone_geom.intersects(class_geom):
-                            intersection = zone_geom.intersection(class_geom)
-                            if not intersection.isEmpty():
-                                measure = self.calculateMeasure(intersection, zones_source, classes_source)
-                                class_measures = self.updateMeasures(class_measures, measure, class_feature, sum_fields)
-                                
-                    percentage = self.calculatePercentage(class_measures, total_zone_measure, zones_source, classes_source)
-                    
-                    if not (class_measures['AREA'] or class_measures['LENGTH'] 
-                            or class_measures['PNT_COUNT'] or percentage):
-                        continue
+                if count_only:
+                    pair_rows.append(class_row)
+                    pair_measures.append(1)
+                    continue
+                
+                # Com contenção total a interseção é a própria geometria
+                # contida; só se calcula a sobreposição quando as fronteiras se cruzam
+                if zone_engine.contains(class_part):
+                    intersection = class_geom
+                elif zone_engine.within(class_part):
+                    intersection = zone_geom
+                else:
+                    intersection = QgsGeometry(zone_engine.intersection(class_part))
+                
+                if intersection.isEmpty():
+                    continue
+                
+                pair_rows.append(class_row)
+                pair_measures.append(measure_fn(intersection))
+            
+            # Redução por grupo, na ordem em que os grupos foram encontrados
+            groups, group_measures, group_sums = self.reduceMeasures(
+                np.array(pair_rows, dtype=np.int64), np.array(pair_measures, dtype=np.float64),
+                row_groups, class_totals, class_values
+            )
+            out_features = []
+            for group, measure, sums in zip(groups, group_measures, group_sums):
+                measure = measure_value(measure)
+                percentage = percent_fn(measure, total_zone_measure)
+                
+                if not (measure or percentage):
+                    continue
 
-                    out_feature = QgsFeature(output_fields)
-                    attrs = []
-                    
-                    for field in zone_fields:
-                        attrs.append(zone_feature[field])
-                    
-                    for field in class_fields_to_add:
-                        attrs.append(class_feature[field])
-                    
-                    metrics = []
-                    if zone_type == QgsWkbTypes.PolygonGeometry and class_type == QgsWkbTypes.PolygonGeometry:
-                        metrics.append(class_measures['AREA'])
-                    if class_type == QgsWkbTypes.LineGeometry:
-                        metrics.append(class_measures['LENGTH'])
-                    if class_type == QgsWkbTypes.PointGeometry:
-                        metrics.append(class_measures['PNT_COUNT'])
-                    
-                    metrics.append(percentage)
-                    attrs.extend(metrics)
-                    
-                    out_feature.setAttributes(attrs)
-                    sink.addFeature(out_feature, QgsFeatureSink.FastInsert)
+                out_feature = QgsFeature(output_fields)
+                attrs = list(zone_attrs)
+                attrs.extend(class_groups[group])
+                attrs.append(measure)
+                attrs.append(percentage)
+                attrs.extend(sums.tolist())
+                
+                out_feature.setAttributes(attrs)
+                out_features.append(out_feature)
+            return out_features
+        
+        # O progresso avança uma vez por feição de zona
+        total = len(zones) or 1
+        current = 0
+        last_progress = -1
+        pending = []
+        
+        # As zonas são independentes depois de construídos o índice e os caches
+        # de classe: cada uma é processada numa thread (o GEOS libera o GIL) e
+        # os resultados são consumidos na ordem das zonas, na thread principal,
+        # que é a única a escrever no sink e a atualizar o feedback. No máximo
+        # max_pending zonas ficam na fila, para que as feições de saída já
+        # escritas no sink não fiquem retidas até o fim da execução.
+        workers = os.cpu_count() or 1
+        max_pending = 2 * workers
+        zone_records = iter(zones)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            queued = deque(executor.submit(process_zone, *record) for record in islice(zone_records, max_pending))
+            while queued:
+                if feedback.isCanceled():
+                    break
+                
+                out_features = queued.popleft().result()
+                record = next(zone_records, None)
+                if record is not None:
+                    queued.append(executor.submit(process_zone, *record))
+                
+                pending.extend(out_features)
+                if len(pending) >= self.BATCH_SIZE:
+                    sink.addFeatures(pending, QgsFeatureSink.FastInsert)
+                    pending = []
                 
+                # O feedback só é atualizado quando o percentual inteiro avança
                 current += 1
-                feedback.setProgress(int((current / total) * 100))
+                progress = current * 100 // total
+                if progress != last_progress:
+                    feedback.setProgress(progress)
+                    last_progress = progress
+        finally:
+            # Em caso de erro ou cancelamento, as zonas ainda na fila são descartadas
+            executor.shutdown(cancel_futures=True)
+        
+        if pending:
+            sink.addFeatures(pending, QgsFeatureSink.FastInsert)
         
         return {self.OUTPUT: dest_id}
 
-    def calculateTotalMeasure(self, geometry, wkb_type):
+    def calculateTotalMeasure(self, geometry, geometry_type):
         """Calcula a medida total da geometria da zona (área/comprimento)"""
-        geometry_type = QgsWkbTypes.geometryType(wkb_type)
-        
-        if geometry_type == QgsWkbTypes.PolygonGeometry:
+        if geometry_type == POLY:
             return geometry.area()
-        elif geometry_type == QgsWkbTypes.LineGeometry:
+        elif geometry_type == LINE:
             return geometry.length()
-        elif geometry_type == QgsWkbTypes.PointGeometry:
+        elif geometry_type == POINT:
             return 1  # Contagem de pontos
         return 0
     
@@ -208,104 +300,133 @@ class SummarizeIntersection(QgsProcessingAlgorithm):
         zone_type = QgsWkbTypes.geometryType(zones.wkbType())
         class_type = QgsWkbTypes.geometryType(classes.wkbType())
         
-        if zone_type == QgsWkbTypes.PointGeometry:
-            if class_type in [QgsWkbTypes.PolygonGeometry, QgsWkbTypes.LineGeometry]:
+        if zone_type == POINT:
+            if class_type in [POLY, LINE]:
                 raise QgsProcessingException("Class features cannot be polygons or lines when zone features are points")
         
-        if zone_type == QgsWkbTypes.LineGeometry:
-            if class_type == QgsWkbTypes.PolygonGeometry:
+        if zone_type == LINE:
+            if class_type == POLY:
                 raise QgsProcessingException("Class features cannot be polygons when zone features are lines")
         
         if class_type > zone_type:
             raise QgsProcessingException("Higher dimension class features are not supported for this zone type")
         
-    def updateMeasures(self, current_measures, measure, class_feature, sum_fields):
-        """Atualiza as métricas acumuladas com base na interseção atual"""
-        try:
-            # Verificar geometria válida
-            if not class_feature.geometry().isGeosValid():
-                return current_measures
-
-            # Determinar tipo de geometria da classe
-            class_type = QgsWkbTypes.geometryType(class_feature.geometry().wkbType())
-            
-            # Atualizar medidas principais com verificação de tipo
-            if class_type == QgsWkbTypes.PolygonGeometry:
-                current_measures['AREA'] += measure if measure else 0.0
-            elif class_type == QgsWkbTypes.LineGeometry:
-                current_measures['LENGTH'] += measure if measure else 0.0
-            elif class_type == QgsWkbTypes.PointGeometry:
-                current_measures['PNT_COUNT'] += int(measure) if measure else 0
-            
-            # Processar campos de soma com tratamento de erros
-            if sum_fields:
-                for field in sum_fields:
-                    if field not in class_feature.fields():
-                        continue
-                    
-                    # Obter valor do atributo com fallback para 0
-                    feature_value = float(class_feature[field]) if class_feature[field] else 0.0
-                    
-                    # Calcular medida total da feature da classe
-                    total_class_measure = self.calculateTotalMeasure(
-                        class_feature.geometry(),
-                        class_feature.geometry().wkbType()
-                    )
-                    
-                    # Calcular proporção com proteção contra divisão por zero
-                    proportion = measure / total_class_measure if total_class_measure != 0 else 0.0
-                    
-                    # Atualizar soma proporcional
-                    current_measures['SUM_FIELDS'][field] += feature_value * proportion
-
-            return current_measures
-
-        except Exception as e:
-            self.feedback.reportError(f"Erro ao processar feature {class_feature.id()}: {str(e)}")
-            return current_measures
-
-
-    def calculateMeasure(self, geometry, zone_source, class_source):
-        zone_type = QgsWkbTypes.geometryType(zone_source.wkbType())
-        class_type = QgsWkbTypes.geometryType(class_source.wkbType())
+    def cacheClassFeature(self, class_feature, class_geom, class_type, sum_field_idx, feedback):
+        """Pré-calcula a medida total e os valores de soma (na ordem de sum_field_idx) de uma feição de classe"""
+        total_class_measure = self.calculateTotalMeasure(class_geom, class_type)
         
-        if zone_type == QgsWkbTypes.PolygonGeometry and class_type == QgsWkbTypes.PolygonGeometry:
-            return geometry.area()
-        elif class_type == QgsWkbTypes.LineGeometry:
-            return geometry.length()
-        elif class_type == QgsWkbTypes.PointGeometry:
-            return 1  # Contagem
-        return 0
+        # Obter valores dos atributos com fallback para 0
+        attributes = class_feature.attributes()
+        sum_values = []
+        for i in sum_field_idx:
+            try:
+                value = attributes[i] if i != -1 else None
+                sum_values.append(float(value) if value else 0.0)
+            except (TypeError, ValueError) as e:
+                feedback.reportError(f"Erro ao processar feature {class_feature.id()}: {str(e)}")
+                sum_values.append(0.0)
+        
+        return total_class_measure, sum_values
 
-    def calculatePercentage(self, class_measures, total_zone_measure, zones_source, classes_source):
-        zone_type = QgsWkbTypes.geometryType(zones_source.wkbType())
-        class_type = QgsWkbTypes.geometryType(classes_source.wkbType())
+    def reduceMeasures(self, pair_rows, pair_measures, row_groups, class_totals, class_values):
+        """Soma, por grupo de classe, as medidas e os campos de soma proporcionais dos pares de uma zona"""
+        groups, cells = np.unique(row_groups[pair_rows], return_inverse=True)
+        group_measures = np.bincount(cells, weights=pair_measures, minlength=len(groups))
         
-        if zone_type == class_type:
-            denominator = total_zone_measure
-        else:
-            denominator = class_measures['AREA'] if class_type == QgsWkbTypes.PolygonGeometry else class_measures['LENGTH']
+        # Proporção da feição de classe dentro da zona, com proteção contra divisão por zero
+        totals = class_totals[pair_rows]
+        proportions = np.divide(pair_measures, totals, out=np.zeros_like(pair_measures), where=totals != 0)
         
-        if denominator == 0:
-            return 0.0
+        # Uma soma por bincount para cada campo de soma (np.add.at é sem buffer e bem mais lento)
+        weighted = class_values[pair_rows] * proportions[:, np.newaxis]
+        group_sums = np.empty((len(groups), class_values.shape[1]))
+        for column in range(class_values.shape[1]):
+            group_sums[:, column] = np.bincount(cells, weights=weighted[:, column], minlength=len(groups))
+        return groups, group_measures, group_sums
+
+    def measureStrategy(self, zone_type, class_type):
+        """Resolve as funções de medida da interseção e de porcentagem para o par de tipos de geometria"""
+        if class_type == POLY:
+            measure_fn = QgsGeometry.area
+        elif class_type == LINE:
+            measure_fn = QgsGeometry.length
+        else:
+            measure_fn = lambda geometry: 1  # Contagem
         
-        if zone_type == QgsWkbTypes.PolygonGeometry:
-            value = class_measures['AREA']
-        elif zone_type == QgsWkbTypes.LineGeometry:
-            value = class_measures['LENGTH']
+        # A porcentagem em relação à zona só existe quando zona e classe têm a
+        # mesma dimensão; nos demais casos ela é sempre zero
+        if zone_type == class_type:
+            def percent_fn(measure, total_zone_measure):
+                return (measure / total_zone_measure) * 100 if total_zone_measure else 0.0
         else:
-            value = class_measures['PNT_COUNT']
+            def percent_fn(measure, total_zone_measure):
+                return 0.0
+        return measure_fn, percent_fn
+
+    def indexClassFeatures(self, source, class_type, fields, sum_field_idx, feedback):
+        """Agrupa as feições de classe e constrói o índice espacial e os caches numa única leitura da fonte"""
+        # Cada grupo de classe recebe um número pela ordem em que aparece;
+        # class_groups guarda os valores dos campos de classe de cada grupo.
+        # Cada feição válida recebe uma linha nas colunas class_geoms (geometria),
+        # row_groups (grupo), class_totals (medida total) e class_values (campos
+        # de soma), calculadas aqui uma única vez; o índice espacial guarda o
+        # número da linha no lugar do id da feição, e as feições em si (com os
+        # demais atributos) não são retidas. Feições com geometria inválida
+        # nunca contribuem e ficam fora do índice espacial.
+        field_idx = [source.fields().lookupField(field) for field in fields]
+        request = QgsFeatureRequest().setSubsetOfAttributes(
+            [i for i in field_idx + sum_field_idx if i != -1]
+        )
+        group_numbers = {}
+        class_groups = []
+        class_index = QgsSpatialIndex()
+        class_geoms = []
+        row_groups = []
+        class_totals = []
+        sum_rows = []
+        for class_feature in source.getFeatures(request):
+            attributes = class_feature.attributes()
+            class_key = tuple(attributes[i] for i in field_idx)
+            if class_key not in group_numbers:
+                group_numbers[class_key] = len(class_groups)
+                class_groups.append(class_key)
+            
+            class_geom = class_feature.geometry()
+            if not class_geom.isGeosValid():
+                continue
+            total_class_measure, sum_values = self.cacheClassFeature(class_feature, class_geom, class_type, sum_field_idx, feedback)
+            class_index.addFeature(len(class_geoms), class_geom.boundingBox())
+            class_geoms.append(class_geom)
+            row_groups.append(group_numbers[class_key])
+            class_totals.append(total_class_measure)
+            sum_rows.append(sum_values)
         
-        return (value / denominator) * 100
+        return (
+            class_groups,
+            class_geoms,
+            class_index,
+            np.array(row_groups, dtype=np.int64),
+            np.array(class_totals, dtype=np.float64),
+            np.array(sum_rows, dtype=np.float64).reshape(len(sum_rows), len(sum_field_idx))
+        )
 
-    def groupFeatures(self, source, fields):
-        groups = {}
-        for feature in source.getFeatures():
-            key = tuple(feature[field] for field in fields) if fields else 'ALL'
-            if key not in groups:
-                groups[key] = []
-            groups[key].append(feature)
-        return groups
+    def readZones(self, source, fields):
+        """Lê as zonas como pares (geometria, valores dos campos), agrupadas pelos valores dos campos"""
+        # Só os campos de zona são lidos da fonte e as feições em si não são
+        # retidas. Cada chave de zona recebe um número pela ordem em que
+        # aparece; uma ordenação estável por esse número devolve as zonas
+        # agrupadas por chave, na ordem da fonte dentro de cada grupo.
+        field_idx = [source.fields().lookupField(field) for field in fields]
+        request = QgsFeatureRequest().setSubsetOfAttributes(field_idx)
+        group_numbers = {}
+        codes = []
+        zones = []
+        for feature in source.getFeatures(request):
+            attributes = feature.attributes()
+            values = [attributes[i] for i in field_idx]
+            codes.append(group_numbers.setdefault(tuple(values), len(group_numbers)))
+            zones.append((feature.geometry(), values))
+        return [zones[i] for i in np.argsort(codes, kind='stable')]
 
     def name(self):
         return 'summarizeintersection'